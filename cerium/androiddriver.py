@@ -18,31 +18,70 @@
 '''The AndroidDriver implementation.'''
 
 
+import asyncio
 import os
 import re
-import tempfile
+import shlex
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
-from lxml import html
+from lxml import etree
 
+from .batch import Batch
 from .by import By
+from .commands import _shell_pool, _ShellSession
 from .elements import Elements
-from .exceptions import (ApplicationsException, CharactersException,
-                         DeviceConnectionException, NoSuchElementException,
-                         NoSuchPackageException)
+from .exceptions import (AndroidDriverException, ApplicationsException,
+                         CharactersException, DeviceConnectionException,
+                         NoSuchElementException, NoSuchPackageException)
+from .injector import MonkeyInjector
 from .intent import Actions, Category
 from .keys import Keys
 from .service import _PATH, Service
-from .utils import merge_dict
+from .utils import memoize_device_prop, merge_dict
+
+_PROP_RE = re.compile(r'^\[([^\]]+)\]:\s*\[([^\]]*)\]$', re.M)
+_BATTERY_RE = re.compile('\n  |: ')
+_IP_RE = re.compile(
+    r"\b(?:(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.){3}(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\b")
+_FOCUSED_RE = re.compile(r'mFocusedActivity: .+(com[a-zA-Z0-9\.]+/.[a-zA-Z0-9\.]+)')
+_CUR_FOCUS_RE = re.compile(r'mCurrentFocus=.+(com[a-zA-Z0-9\.]+/.[a-zA-Z0-9\.]+)')
+_SURFACE_RE = re.compile(r"name=([a-zA-Z0-9\.]+/.[a-zA-Z0-9\.]+)")
+_TOTAL_TIME_RE = re.compile(r'TotalTime: \d+')
+_WM_SIZE_RE = re.compile(r'(\d+)x(\d+)')
+_WM_DENSITY_RE = re.compile(r'Physical density:\s*(\d+)')
+_CJK_FIND = re.compile(r'[\u4e00-\u9fff]').search
+_BOUNDS_TRANS = str.maketrans('[],', '   ')
+_SYNC_OPTIONS = frozenset({'system', 'vendor', 'oem', 'data', 'all'})
+_UI_PARSE_OPTIONS = {'huge_tree': True, 'remove_blank_text': True, 'recover': True}
+_UI_CHUNK_SIZE = 32768
+
+
+_INTERACTIVE_ATTRS = ('clickable', 'long-clickable', 'scrollable', 'checkable', 'focusable')
+
+
+def _is_addressable(attrib) -> bool:
+    '''Whether a dumped node can be acted on or located by id, text or content-desc.'''
+    # Nodes dumped without these flags are kept, only explicit 'false' counts.
+    return (any(attrib.get(name, 'true') == 'true' for name in _INTERACTIVE_ATTRS)
+            or bool(attrib.get('resource-id') or attrib.get('text') or attrib.get('content-desc')))
 
 
 class BaseAndroidDriver(Service):
     '''Controls Android Debug Bridge and allows you to drive the android device.'''
 
     _element_cls = Elements
-    _temp = os.path.join(tempfile.gettempdir(), 'uidump.xml')
+    _batch_cls = Batch
+    _injector_cls = MonkeyInjector
+    _injector = None
+    _ip_cache = None
+    _shell_prefix = None
     _nodes = None
+    _index = None
+    _strict_ui = True
+    _indexed_attrs = (By.ID, By.TEXT, By.CLASS, By.CONTENT_DESC)
 
-    def __init__(self, executable_path: _PATH = 'default', device_sn: str = None, wireless: bool = False, host: str = '192.168.0.3', port: str or int = 5555, service_port: str or int =5037, env: dict = None, service_args: list or tuple = None, dev: bool = False) -> None:
+    def __init__(self, executable_path: _PATH = 'default', device_sn: str = None, wireless: bool = False, host: str = '192.168.0.3', port: str or int = 5555, service_port: str or int =5037, env: dict = None, service_args: list or tuple = None, dev: bool = False, push_pool_size: int = 4, strict_ui: bool = True) -> None:
         '''Creates a new instance of the android driver.
 
         Starts the service and then creates new instance of android driver.
@@ -57,9 +96,15 @@ class BaseAndroidDriver(Service):
                                          if left as 0, a free port will be found.
             env: Environment variables.
             service_args: List of args to pass to the androiddriver service.
+            push_pool_size: Number of concurrent transfers used by push_many and pull_many.
+            strict_ui: Skip layout-only nodes of the interface, those that cannot be clicked,
+                                         scrolled, checked or focused and have no id, text or content-desc.
         '''
 
         self._dev = dev
+        self._push_pool_size = push_pool_size
+        self._strict_ui = strict_ui
+        self._prop_cache = {}
         super(BaseAndroidDriver, self).__init__(executable_path=executable_path,
                                                 port=service_port, env=env, service_args=service_args)
         self.start()
@@ -103,19 +148,118 @@ class BaseAndroidDriver(Service):
 
     def _execute(self, *args: str, **kwargs) -> tuple:
         '''Execute command.'''
+        return self._execute_rc(*args, **kwargs)[:2]
+
+    def _execute_rc(self, *args: str, **kwargs) -> tuple:
+        '''Execute command, and also return its exit status.'''
         process = self.execute(
             args=args, options=merge_dict(self.options, kwargs))
         command = ' '.join(process.args)
+        output, error = process.communicate()
+        self._debug(command, output, error)
+        return output, error, process.returncode
+
+    def _debug(self, command: str, output, error) -> None:
+        '''Print the command and what it returned, if the driver runs in dev mode.'''
         if self._dev:
-            output, error = process.communicate()
             print(
                 "Debug Information",
                 "Command: {!r}".format(command),
-                "Output: {!r}".format(output.encode('utf-8')),
-                "Error: {!r}".format(error.encode('utf-8')),
+                "Output: {!r}".format(output.encode('utf-8') if isinstance(output, str) else output),
+                "Error: {!r}".format(error.encode('utf-8') if isinstance(error, str) else error),
                 sep='\n', end='\n{}\n'.format('=' * 80)
             )
-        return process.communicate()
+
+    @staticmethod
+    def set_max_sessions(max_sessions: int) -> None:
+        '''Set how many shell sessions the process keeps open across all drivers.'''
+        _shell_pool.max_sessions = max_sessions
+
+    @classmethod
+    def parallel(cls, drivers: list, method_name: str, *args, **kwargs) -> list:
+        '''Call the same method on several drivers concurrently.
+
+        Each driver talks to its own device, so the calls only wait on adb
+        and can overlap. Calls on the same driver, e.g. a find_element
+        followed by a click, must still be sequenced by the caller.
+
+        Returns:
+            The results, in the order of drivers.
+        '''
+        if not drivers:
+            return []
+        with ThreadPoolExecutor(max_workers=len(drivers)) as executor:
+            futures = [executor.submit(getattr(driver, method_name), *args, **kwargs)
+                       for driver in drivers]
+            return [future.result() for future in futures]
+
+    @classmethod
+    def broadcast_shell(cls, drivers: list, cmd: str) -> list:
+        '''Run a shell command on several devices concurrently.
+
+        Returns:
+            A list of (output, error) tuples, in the order of drivers.
+        '''
+        return cls.parallel(drivers, '_shell_exec', cmd)
+
+    def _shell_cmd(self) -> tuple:
+        '''The adb command line of the device shell, rebuilt only when the device changes.'''
+        if self._shell_prefix is None or self._shell_prefix[0] != self.device_sn:
+            self._shell_prefix = (self.device_sn, tuple(
+                self._build_cmd(['-s', self.device_sn, 'shell'])))
+        return self._shell_prefix[1]
+
+    def _shell(self) -> _ShellSession:
+        '''Return the persistent shell session of the current device.'''
+        return _shell_pool.get(self._shell_cmd(), env=self.options.get('env'))
+
+    def _shell_exec(self, *args: str, timeout: float = None) -> tuple:
+        '''Execute command in the persistent shell of the device.'''
+        return self._shell_exec_rc(*args, timeout=timeout)[:2]
+
+    def _shell_exec_rc(self, *args: str, timeout: float = None) -> tuple:
+        '''Execute command in the persistent shell of the device, and also return its exit status.'''
+        command = ' '.join(args)
+        output, error, returncode = self._shell().execute(command, timeout=timeout)
+        self._debug(command, output, error)
+        return output, error, returncode
+
+    async def _aexecute(self, *args: str) -> tuple:
+        '''Execute command without blocking the event loop.
+
+        On Windows this requires a ProactorEventLoop, the default since Python 3.8.
+        '''
+        return (await self._aexecute_rc(*args))[:2]
+
+    async def _aexecute_rc(self, *args: str) -> tuple:
+        '''Execute command without blocking the event loop, and also return its exit status.'''
+        process = await asyncio.create_subprocess_exec(
+            *self._build_cmd(args), stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE, env=self.options.get('env'))
+        output, error = await process.communicate()
+        return output.decode('utf-8'), error.decode('utf-8'), process.returncode
+
+    async def _ashell(self, *args: str) -> tuple:
+        '''Execute shell command without blocking the event loop.'''
+        return await self._aexecute('-s', self.device_sn, 'shell', *args)
+
+    def quit(self) -> None:
+        '''Close the shell session and the input injector of the device.'''
+        self.stop_injector()
+        _shell_pool.discard(self._shell_cmd())
+
+    def close(self) -> None:
+        '''Same as quit().'''
+        self.quit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.quit()
+
+    def __del__(self):
+        self.stop_injector()
 
     # Android Device Information
     @property
@@ -128,11 +272,19 @@ class BaseAndroidDriver(Service):
         """Returns a device matcher for the given serial."""
         return lambda device: device.serial_number == serial
 
+    def _load_all_props(self) -> dict:
+        '''Dump every system property with a single getprop call.'''
+        output, _ = self._shell_exec('getprop')
+        return dict(_PROP_RE.findall(output))
+
+    @memoize_device_prop
+    def _props_cached(self) -> dict:
+        '''System properties of the device, loaded once per session.'''
+        return self._load_all_props()
+
     def get_device_model(self) -> str:
         '''Show device model.'''
-        output, _ = self._execute(
-            '-s', self.device_sn, 'shell', 'getprop', 'ro.product.model')
-        return output.strip()
+        return self._props_cached().get('ro.product.model', '')
 
     def get_battery_info(self) -> dict:
         '''Show device battery information.
@@ -155,66 +307,65 @@ class BaseAndroidDriver(Service):
                 'temperature': '310',
                 'voltage': '3965'}
         '''
-        output, _ = self._execute(
-            '-s', self.device_sn, 'shell', 'dumpsys', 'battery')
-        battery_status = re.split('\n  |: ', output[33:].strip())
+        output, _ = self._shell_exec('dumpsys', 'battery')
+        battery_status = _BATTERY_RE.split(output[33:].strip())
         return dict(zip(battery_status[::2], battery_status[1::2]))
 
-    def get_resolution(self) -> list:
-        '''Show device resolution.'''
-        output, _ = self._execute('-s', self.device_sn, 'shell', 'wm', 'size')
-        return output.split()[2].split('x')
+    @memoize_device_prop
+    def get_resolution(self) -> tuple:
+        '''Show device resolution as (width, height).'''
+        output, _ = self._shell_exec('wm', 'size')
+        return tuple(map(int, _WM_SIZE_RE.search(output).groups()))
 
-    def get_screen_density(self) -> str:
+    @memoize_device_prop
+    def get_screen_density(self) -> int:
         '''Show device screen density (PPI).'''
-        output, _ = self._execute(
-            '-s', self.device_sn, 'shell', 'wm', 'density')
-        return output.split()[2]
+        output, _ = self._shell_exec('wm', 'density')
+        return int(_WM_DENSITY_RE.search(output).group(1))
 
     def get_displays_params(self) -> str:
         '''Show displays parameters.'''
-        output, error = self._execute(
-            '-s', self.device_sn, 'shell', 'dumpsys', 'window', 'displays')
+        output, error = self._shell_exec('dumpsys', 'window', 'displays')
         return output
 
+    @memoize_device_prop
     def get_android_id(self) -> str:
         '''Show Android ID.'''
-        output, _ = self._execute(
-            '-s', self.device_sn, 'shell', 'settings', 'get', 'secure', 'android_id')
+        output, _ = self._shell_exec('settings', 'get', 'secure', 'android_id')
         return output.strip()
 
     def get_android_version(self) -> str:
         '''Show Android version.'''
-        output, _ = self._execute(
-            '-s', self.device_sn, 'shell', 'getprop', 'ro.build.version.release')
-        return output.strip()
+        return self._props_cached().get('ro.build.version.release', '')
 
+    @memoize_device_prop
     def get_device_mac(self) -> str:
         '''Show device MAC.'''
-        output, _ = self._execute(
-            '-s', self.device_sn, 'shell', 'cat', '/sys/class/net/wlan0/address')
+        output, _ = self._shell_exec('cat', '/sys/class/net/wlan0/address')
         return output.strip()
 
+    @memoize_device_prop
     def get_cpu_info(self) -> str:
         '''Show device CPU information.'''
-        output, _ = self._execute(
-            '-s', self.device_sn, 'shell', 'cat', '/proc/cpuinfo')
+        output, _ = self._shell_exec('cat', '/proc/cpuinfo')
         return output
 
     def get_memory_info(self) -> str:
         '''Show device memory information.'''
-        output, _ = self._execute(
-            '-s', self.device_sn, 'shell', 'cat', '/proc/meminfo')
+        output, _ = self._shell_exec('cat', '/proc/meminfo')
         return output
 
     def get_sdk_version(self) -> str:
         '''Show Android SDK version.'''
-        output, _ = self._execute(
-            '-s', self.device_sn, 'shell', 'getprop', 'ro.build.version.sdk')
-        return output.strip()
+        return self._props_cached().get('ro.build.version.sdk', '')
+
+    def invalidate_device_props(self) -> None:
+        '''Forget the cached device properties, they will be fetched again on next access.'''
+        self._prop_cache.clear()
 
     def root(self) -> None:
         '''Restart adbd with root permissions.'''
+        self.invalidate_device_props()
         output, _ = self._execute('-s', self.device_sn, 'root')
         if not output:
             raise PermissionError(
@@ -222,22 +373,51 @@ class BaseAndroidDriver(Service):
 
     def unroot(self) -> None:
         '''Restart adbd without root permissions.'''
+        self.invalidate_device_props()
         self._execute('-s', self.device_sn, 'unroot')
 
     def tcpip(self, port: int or str = 5555) -> None:
         '''Restart adb server listening on TCP on PORT.'''
+        self._ip_cache = None
         self._execute('-s', self.device_sn, 'tcpip', str(port))
 
+    def connect(self, host: str = '192.168.0.3', port: str or int = 5555) -> None:
+        '''Connect to a device via TCP/IP directly.'''
+        self._ip_cache = None
+        super(BaseAndroidDriver, self).connect(host, port)
+
+    def disconnect(self, host: str = '192.168.0.3', port: str or int = 5555) -> None:
+        '''Disconnect from given TCP/IP device [default port=5555].'''
+        self._ip_cache = None
+        super(BaseAndroidDriver, self).disconnect(host, port)
+
+    def disconnect_all(self) -> None:
+        '''Disconnect all.'''
+        self._ip_cache = None
+        super(BaseAndroidDriver, self).disconnect_all()
+
     def get_ip_addr(self) -> str:
         '''Show IP Address.'''
-        output, _ = self._execute(
-            '-s', self.device_sn, 'shell', 'ip', '-f', 'inet', 'addr', 'show', 'wlan0')
-        ip_addr = re.findall(
-            r"\b(?:(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.){3}(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\b", output)
+        host = self._cached_ip_addr()
+        if host is None:
+            output, _ = self._shell_exec('ip', '-f', 'inet', 'addr', 'show', 'wlan0')
+            host = self._cache_ip_addr(output)
+        return host
+
+    def _cached_ip_addr(self) -> str:
+        '''The IP address cached for the current device, None if there is none.'''
+        if self._ip_cache is not None and self._ip_cache[0] == self.device_sn:
+            return self._ip_cache[1]
+        return None
+
+    def _cache_ip_addr(self, output: str) -> str:
+        '''Parse the IP address out of `ip addr` output, and cache it for the current device.'''
+        ip_addr = _IP_RE.search(output)
         if not ip_addr:
             raise ConnectionError(
                 'The device is not connected to WLAN or not connected via USB.')
-        return ip_addr[0]
+        self._ip_cache = (self.device_sn, ip_addr.group())
+        return self._ip_cache[1]
 
     def auto_connect(self, port: int or str =5555) -> None:
         '''Connect to a device via TCP/IP automatically.'''
@@ -246,6 +426,26 @@ class BaseAndroidDriver(Service):
         self.connect(host, port)
         print('Now you can unplug the USB cable, and control your device via WLAN.')
 
+    async def auto_connect_async(self, port: int or str = 5555) -> None:
+        '''Connect to a device via TCP/IP automatically, without blocking the event loop.
+
+        Usage:
+            asyncio.run(driver.auto_connect_async())
+
+            # Several devices at once.
+            await asyncio.gather(*(d.auto_connect_async() for d in drivers))
+        '''
+        host = self._cached_ip_addr()
+        if host is None:
+            output, _ = await self._ashell('ip', '-f', 'inet', 'addr', 'show', 'wlan0')
+            host = self._cache_ip_addr(output)
+        self._ip_cache = None
+        await self._aexecute('-s', self.device_sn, 'tcpip', str(port))
+        # connect probes the port with a blocking socket, keep it off the event loop.
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self.connect, host, port)
+        print('Now you can unplug the USB cable, and control your device via WLAN.')
+
     def push(self, local: _PATH = 'LICENSE', remote: _PATH = '/sdcard/LICENSE') -> None:
         '''Copy local files/directories to device.'''
         if not os.path.exists(local):
@@ -260,15 +460,47 @@ class BaseAndroidDriver(Service):
 
     def pull(self, remote: _PATH, local: _PATH) -> None:
         '''Copy files/directories from device.'''
-        output, _ = self._execute('-s', self.device_sn, 'pull', remote, local)
-        if 'error' in output:
+        _, _, returncode = self._execute_rc('-s', self.device_sn, 'pull', remote, local)
+        if returncode:
             raise FileNotFoundError(f'Remote {remote!r} does not exist.')
 
     def pull_a(self, remote: _PATH, local: _PATH) -> None:
         '''Copy files/directories from device, and preserve file timestamp and mode.'''
-        output, _ = self._execute(
+        _, _, returncode = self._execute_rc(
             '-s', self.device_sn, 'pull', '-a', remote, local)
-        if 'error' in output:
+        if returncode:
+            raise FileNotFoundError(f'Remote {remote!r} does not exist.')
+
+    def push_many(self, pairs: list, *, workers: int = None) -> None:
+        '''Copy several local files/directories to device concurrently.
+
+        Args:
+            pairs: List of (local, remote) tuples.
+            workers: Number of concurrent transfers, defaults to push_pool_size.
+        '''
+        with ThreadPoolExecutor(max_workers=workers or self._push_pool_size) as executor:
+            list(executor.map(lambda pair: self.push(*pair), pairs))
+
+    def pull_many(self, pairs: list, *, workers: int = None) -> None:
+        '''Copy several files/directories from device concurrently.
+
+        Args:
+            pairs: List of (remote, local) tuples.
+            workers: Number of concurrent transfers, defaults to push_pool_size.
+        '''
+        with ThreadPoolExecutor(max_workers=workers or self._push_pool_size) as executor:
+            list(executor.map(lambda pair: self.pull(*pair), pairs))
+
+    async def _apush(self, local: _PATH, remote: _PATH) -> None:
+        '''Copy local files/directories to device without blocking the event loop.'''
+        if not os.path.exists(local):
+            raise FileNotFoundError(f'Local {local!r} does not exist.')
+        await self._aexecute('-s', self.device_sn, 'push', local, remote)
+
+    async def _apull(self, remote: _PATH, local: _PATH) -> None:
+        '''Copy files/directories from device without blocking the event loop.'''
+        _, _, returncode = await self._aexecute_rc('-s', self.device_sn, 'pull', remote, local)
+        if returncode:
             raise FileNotFoundError(f'Remote {remote!r} does not exist.')
 
     def sync(self, option: str = 'all') -> None:
@@ -277,7 +509,7 @@ class BaseAndroidDriver(Service):
         Args:
             option: 'system', 'vendor', 'oem', 'data', 'all'
         '''
-        if option in ['system', 'vendor', 'oem', 'data', 'all']:
+        if option in _SYNC_OPTIONS:
             self._execute('-s', self.device_sn, 'sync', option)
         else:
             raise ValueError(f'There is no option named: {option!r}.')
@@ -288,7 +520,7 @@ class BaseAndroidDriver(Service):
         Args:
             option: 'system', 'vendor', 'oem', 'data', 'all'
         '''
-        if option in ['system', 'vendor', 'oem', 'data', 'all']:
+        if option in _SYNC_OPTIONS:
             self._execute('-s', self.device_sn, 'sync', '-l', option)
         else:
             raise ValueError('There is no option named: {!r}.'.format(option))
@@ -365,8 +597,7 @@ class BaseAndroidDriver(Service):
         '''
         if option not in ['-f', '-d', '-e', '-s', '-3', '-i', '-u']:
             raise ValueError(f'There is no option called {option!r}.')
-        output, _ = self._execute(
-            '-s', self.device_sn, 'shell', 'pm', 'list', 'packages', option, keyword)
+        output, _ = self._shell_exec('pm', 'list', 'packages', option, keyword)
         return list(map(lambda x: x[8:], output.splitlines()))
 
     def view_package_path(self, package: str) -> _PATH:
@@ -374,8 +605,7 @@ class BaseAndroidDriver(Service):
         if package not in self.view_packgets_list():
             raise NoSuchPackageException(
                 f'There is no such package {package!r}.')
-        output, _ = self._execute(
-            '-s', self.device_sn, 'shell', 'pm', 'path', package)
+        output, _ = self._shell_exec('pm', 'path', package)
         return output[8:-1]
 
     def clear_app_data(self, package: str) -> None:
@@ -383,37 +613,32 @@ class BaseAndroidDriver(Service):
         if package not in self.view_packgets_list():
             raise NoSuchPackageException(
                 f'There is no such package {package!r}.')
-        self._execute('-s', self.device_sn, 'shell', 'pm', 'clear', package)
+        self._shell_exec('pm', 'clear', package)
 
     def view_focused_activity(self) -> str:
         '''View focused activity.'''
-        output, _ = self._execute(
-            '-s', self.device_sn, 'shell', 'dumpsys', 'activity', 'activities')
-        return re.findall(r'mFocusedActivity: .+(com[a-zA-Z0-9\.]+/.[a-zA-Z0-9\.]+)', output)[0]
+        output, _ = self._shell_exec('dumpsys', 'activity', 'activities')
+        return _FOCUSED_RE.search(output).group(1)
 
     def view_running_services(self, package: str='') -> str:
         '''View running services.'''
-        output, _ = self._execute(
-            '-s', self.device_sn, 'shell', 'dumpsys', 'activity', 'services', package)
+        output, _ = self._shell_exec('dumpsys', 'activity', 'services', package)
         return output
 
     def view_package_info(self, package: str='') -> str:
         '''View package detail information.'''
-        output, _ = self._execute(
-            '-s', self.device_sn, 'shell', 'dumpsys', 'package', package)
+        output, _ = self._shell_exec('dumpsys', 'package', package)
         return output
 
     def view_current_app_behavior(self) -> str:
         '''View application behavior in the current window.'''
-        output, _ = self._execute(
-            '-s', self.device_sn, 'shell', 'dumpsys', 'window', 'windows')
-        return re.findall(r'mCurrentFocus=.+(com[a-zA-Z0-9\.]+/.[a-zA-Z0-9\.]+)', output)[0]
+        output, _ = self._shell_exec('dumpsys', 'window', 'windows')
+        return _CUR_FOCUS_RE.search(output).group(1)
 
     def view_surface_app_activity(self) -> str:
         '''Get package with activity of applications that are running in the foreground.'''
-        output, error = self._execute(
-            '-s', self.device_sn, 'shell', 'dumpsys', 'window', 'w')
-        return re.findall(r"name=([a-zA-Z0-9\.]+/.[a-zA-Z0-9\.]+)", output)
+        output, error = self._shell_exec('dumpsys', 'window', 'w')
+        return _SURFACE_RE.findall(output)
 
     # Interact with Applications
     def _app_base_start(self, option: str, args: list or tuple) -> None:
@@ -424,9 +649,9 @@ class BaseAndroidDriver(Service):
                 -c <CATEGORY>
                 -n <COMPONENT>
         '''
-        _, error = self._execute('-s', self.device_sn,
-                                 'shell', 'am', 'start', option, *args)
-        if error and error.startswith('Error'):
+        self._invalidate_ui()
+        _, error, returncode = self._shell_exec_rc('am', 'start', option, *args)
+        if returncode or error.startswith('Error'):
             raise ApplicationsException(error.split(':', 1)[-1].strip())
 
     def app_start_action(self, *args) -> None:
@@ -443,29 +668,27 @@ class BaseAndroidDriver(Service):
 
     def app_start_service(self, *args) -> None:
         '''Start a service.'''
-        _, error = self._execute('-s', self.device_sn,
-                                 'shell', 'am', 'startservice', *args)
-        if error and error.startswith('Error'):
+        self._invalidate_ui()
+        _, error, returncode = self._shell_exec_rc('am', 'startservice', *args)
+        if returncode or error.startswith('Error'):
             raise ApplicationsException(error.split(':', 1)[-1].strip())
 
     def app_stop_service(self, *args) -> None:
         '''Stop a service'''
-        _, error = self._execute('-s', self.device_sn, 'shell',
-                                 'am', 'stopservice', *args)
-        if error and error.startswith('Error'):
+        _, error, returncode = self._shell_exec_rc('am', 'stopservice', *args)
+        if returncode or error.startswith('Error'):
             raise ApplicationsException(error.split(':', 1)[-1].strip())
 
     def app_broadcast(self, *args) -> None:
         '''Send a broadcast.'''
-        _, error = self._execute('-s', self.device_sn, 'shell',
-                                 'am', 'broadcast', *args)
-        if error:
+        _, error, returncode = self._shell_exec_rc('am', 'broadcast', *args)
+        if returncode or error:
             raise ApplicationsException(error.split(':', 1)[-1].strip())
 
     def close_app(self, package: str) -> None:
         '''Close an application.'''
-        self._execute('-s', self.device_sn, 'shell',
-                      'am', 'force-stop', package)
+        self._invalidate_ui()
+        self._shell_exec('am', 'force-stop', package)
 
     def app_trim_memory(self, pid: int or str, level: str = 'RUNNING_LOW') -> None:
         '''Trim memory.
@@ -474,31 +697,39 @@ class BaseAndroidDriver(Service):
             level: HIDDEN | RUNNING_MODERATE | BACKGROUNDRUNNING_LOW | \
                      MODERATE | RUNNING_CRITICAL | COMPLETE
         '''
-        _, error = self._execute('-s', self.device_sn, 'shell',
-                                 'am', 'send-trim-memory', str(pid), level)
-        if error and error.startswith('Error'):
+        _, error, returncode = self._shell_exec_rc('am', 'send-trim-memory', str(pid), level)
+        if returncode or error.startswith('Error'):
             raise ApplicationsException(error.split(':', 1)[-1].strip())
 
     def app_start_up_time(self, package: str) -> str:
         '''Get the time it took to launch your application.'''
-        output, _ = self._execute(
-            '-s', self.device_sn, 'shell', 'am', 'start', '-W', package)
-        return re.findall('TotalTime: \d+', output)[0]
+        self._invalidate_ui()
+        output, _ = self._shell_exec('am', 'start', '-W', package)
+        return _TOTAL_TIME_RE.search(output).group()
 
     def screencap(self, filename: _PATH='/sdcard/screencap.png') -> None:
         '''Taking a screenshot of a device display.'''
-        self._execute('-s', self.device_sn, 'shell',
-                      'screencap', '-p', filename)
+        self._shell_exec('screencap', '-p', filename)
+
+    def get_screencap_bytes(self) -> bytes:
+        '''Taking a screenshot of a device display, and return the PNG data.'''
+        output, _ = self._execute('-s', self.device_sn, 'exec-out',
+                                  'screencap', '-p', encoding=None)
+        return output
 
     def pull_screencap(self, remote: _PATH = '/sdcard/screencap.png', local: _PATH = 'screencap.png') -> None:
-        '''Taking a screenshot of a device display, then copy it to your computer.'''
-        self.screencap(remote)
-        self.pull(remote, local)
+        '''Taking a screenshot of a device display, then copy it to your computer.
+
+        The screenshot is streamed to the computer, `remote` is kept for compatibility.
+        '''
+        with open(local, 'wb') as f:
+            f.write(self.get_screencap_bytes())
 
     def screencap_exec(self, filename: _PATH = 'screencap.png') -> None:
         '''Taking a screenshot of a device display, then copy it to your computer.'''
-        self._execute('-s', self.device_sn, 'exec-out',
-                      'screencap', '-p', '>', filename, shell=True)
+        with open(filename, 'wb') as f:
+            self._execute('-s', self.device_sn, 'exec-out',
+                          'screencap', '-p', stdout=f, encoding=None)
 
     def screenrecord(self, bit_rate: int = 5000000, time_limit: int = 180, filename: _PATH = '/sdcard/demo.mp4') -> None:
         '''Recording the display of devices running Android 4.4 (API level 19) and higher.
@@ -507,8 +738,7 @@ class BaseAndroidDriver(Service):
             bit_rate:You can increase the bit rate to improve video quality, but doing so results in larger movie files.
             time_limit: Sets the maximum recording time, in seconds, and the maximum value is 180 (3 minutes).
         '''
-        self._execute('-s', self.device_sn, 'shell',
-                      'screenrecord', '--bit-rate', str(bit_rate), '--time-limit', str(time_limit), filename)
+        self._shell_exec('screenrecord', '--bit-rate', str(bit_rate), '--time-limit', str(time_limit), filename)
 
     def pull_screenrecord(self, bit_rate: int = 5000000, time_limit: int = 180, remote: _PATH = '/sdcard/demo.mp4', local: _PATH = 'demo.mp4') -> None:
         '''Recording the display of devices running Android 4.4 (API level 19) and higher. Then copy it to your computer.
@@ -520,95 +750,247 @@ class BaseAndroidDriver(Service):
         self.screenrecord(bit_rate, time_limit, filename=remote)
         self.pull(remote, local)
 
+    def screenrecord_exec(self, bit_rate: int = 5000000, time_limit: int = 180, filename: _PATH = 'demo.h264') -> None:
+        '''Recording the display of devices running Android 5.0 (API level 21) and higher, then stream it to your computer.
+
+        The recording is written to `filename` as a raw H.264 stream, without landing a file on the device.
+
+        Args:
+            bit_rate:You can increase the bit rate to improve video quality, but doing so results in larger movie files.
+            time_limit: Sets the maximum recording time, in seconds, and the maximum value is 180 (3 minutes).
+        '''
+        with open(filename, 'wb') as f:
+            self._execute('-s', self.device_sn, 'exec-out', 'screenrecord', '--output-format=h264',
+                          '--bit-rate', str(bit_rate), '--time-limit', str(time_limit), '-',
+                          stdout=f, encoding=None)
+
+    def start_injector(self, port: int = 1080) -> None:
+        '''Inject taps, swipes and keyevents through a persistent monkey server.
+
+        `input` starts a new Java VM on the device for every event, which can
+        take up to a second. The monkey server is started once on `port` and
+        each event then costs a socket round trip.
+        '''
+        if self._injector is None:
+            injector = self._injector_cls(self, port)
+            injector.start()
+            self._injector = injector
+
+    def stop_injector(self) -> None:
+        '''Stop the monkey server, events go through `input` again.'''
+        if self._injector is not None:
+            self._injector.close()
+            self._injector = None
+
+    def _click_cmd(self, x: int, y: int) -> str:
+        return f'input tap {x} {y}'
+
+    def _swipe_cmd(self, x1: int, y1: int, x2: int, y2: int, duration: int) -> str:
+        return f'input swipe {x1} {y1} {x2} {y2} {duration}'
+
+    def _send_keys_cmd(self, text: str) -> str:
+        m = _CJK_FIND(text)
+        if m is not None:
+            raise CharactersException(
+                f'Text cannot contain non-English characters, such as {m.group(0)!r}.')
+        return f'input text {shlex.quote(text)}'
+
+    def _keyevent_cmd(self, keyevent: int, long_press: bool = False) -> str:
+        if long_press:
+            return f'input keyevent --longpress {keyevent}'
+        return f'input keyevent {keyevent}'
+
     def click(self, x: int, y: int) -> None:
         '''Simulate finger click.'''
-        self._execute('-s', self.device_sn, 'shell',
-                      'input', 'tap', str(x), str(y))
+        self._invalidate_ui()
+        if self._injector is not None:
+            self._injector.tap(x, y)
+        else:
+            self._shell_exec(self._click_cmd(x, y))
 
     def swipe(self, x1: int, y1: int, x2: int, y2: int, duration: int = 100) -> None:
         '''Simulate finger swipe. (1000ms = 1s)'''
-        self._execute('-s', self.device_sn, 'shell',
-                      'input', 'swipe', str(x1), str(y1), str(x2), str(y2), str(duration))
+        self._invalidate_ui()
+        if self._injector is not None:
+            self._injector.swipe(x1, y1, x2, y2, duration)
+        else:
+            self._shell_exec(self._swipe_cmd(x1, y1, x2, y2, duration))
 
     def long_press(self, x: int, y: int, duration: int = 1000) -> None:
         '''Simulate finger long press somewhere. (1000ms = 1s)'''
-        self._execute('-s', self.device_sn, 'shell',
-                      'input', 'swipe', str(x), str(y), str(x), str(y), str(duration))
-                
+        self._invalidate_ui()
+        if self._injector is not None:
+            self._injector.long_press(x, y, duration)
+        else:
+            self._shell_exec(self._swipe_cmd(x, y, x, y, duration))
+
     def send_keys(self, text: str = 'cerium') -> None:
         '''Simulates typing keys.'''
-        for char in text:
-            if '\u4e00' <= char <= '\u9fff':
-                raise CharactersException(
-                    f'Text cannot contain non-English characters, such as {char!r}.')
-        text = re.escape(text)
-        self._execute('-s', self.device_sn, 'shell',
-                      'input', 'text', text)
+        cmd = self._send_keys_cmd(text)
+        self._invalidate_ui()
+        self._shell_exec(cmd)
 
     def send_keyevents(self, keyevent: int) -> None:
         '''Simulates typing keyevents.'''
-        self._execute('-s', self.device_sn, 'shell',
-                      'input', 'keyevent', str(keyevent))
+        self._invalidate_ui()
+        if self._injector is not None:
+            self._injector.press(keyevent)
+        else:
+            self._shell_exec(self._keyevent_cmd(keyevent))
 
     def send_keyevents_long_press(self, keyevent: int) -> None:
         '''Simulates typing keyevents long press.'''
-        self._execute('-s', self.device_sn, 'shell',
-                      'input', 'keyevent', '--longpress', str(keyevent))
+        self._invalidate_ui()
+        self._shell_exec(self._keyevent_cmd(keyevent, long_press=True))
+
+    def execute_script(self, cmds: list, stop_on_error: bool = False) -> str:
+        '''Run several shell commands in a single command line and return the output.
+
+        Args:
+            stop_on_error: If True, a failing command skips the ones after it,
+                                         and AndroidDriverException is raised.
+        '''
+        self._invalidate_ui()
+        output, error, returncode = self._shell_exec_rc(
+            (' && ' if stop_on_error else ' ; ').join(cmds))
+        if stop_on_error and returncode:
+            raise AndroidDriverException(
+                f'The script stopped with exit status {returncode}: {error.strip()!r}.')
+        return output
+
+    def batch(self, stop_on_error: bool = False) -> Batch:
+        '''Collect actions and run them in a single shell command line on exit.
+
+        Args:
+            stop_on_error: If True, a failing action skips the ones after it.
+
+        Usage:
+            with driver.batch() as b:
+                b.click(500, 250)
+                b.send_keys('cerium')
+                b.send_keyevents(Keys.ENTER)
+        '''
+        return self._batch_cls(self, stop_on_error)
 
     def send_monkey(self, *args) -> None:
         '''Generate pseudo-random user events to simulate clicks, touches, gestures, etc.'''
-        self._execute('-s', self.device_sn, 'shell', 'monkey', *args)
+        self._invalidate_ui()
+        self._shell_exec('monkey', *args)
 
     def reboot(self) -> None:
         '''Reboot the device.'''
+        self.invalidate_device_props()
+        self._ip_cache = None
         self._execute('-s', self.device_sn, 'reboot')
 
     def recovery(self) -> None:
         '''Reboot to recovery mode.'''
+        self.invalidate_device_props()
+        self._ip_cache = None
         self._execute('-s', self.device_sn, 'reboot', 'recovery')
 
     def fastboot(self) -> None:
         '''Reboot to bootloader mode.'''
+        self.invalidate_device_props()
+        self._ip_cache = None
         self._execute('-s', self.device_sn, 'reboot', 'bootloader')
 
     def uidump(self, local: _PATH = None) -> None:
-        '''Get the current interface layout file.'''
-        local = local if local else self._temp
-        self._execute('-s', self.device_sn, 'shell', 'uiautomator',
-                      'dump', '--compressed', '/data/local/tmp/uidump.xml')
-        self.pull('/data/local/tmp/uidump.xml', local)
-        ui = html.fromstring(open(local, 'rb').read())
-        self._nodes = ui.iter(tag="node")
+        '''Get the current interface layout, and save it to `local` if given.'''
+        process = self.execute(
+            args=('-s', self.device_sn, 'exec-out', 'uiautomator', 'dump', '--compressed', '/dev/tty'),
+            options=merge_dict(self.options, {'encoding': None}))
+        # The dump is plain XML, so use the XML parser rather than the HTML one.
+        parser = etree.XMLPullParser(events=('start', 'end'), tag='node', **_UI_PARSE_OPTIONS)
+        nodes = []
+        # The eager indexes are filled as the nodes are parsed, in the same pass.
+        indexes = [(by, defaultdict(list)) for by in self._indexed_attrs]
+        strict = self._strict_ui
+        rest = b''
+        f = open(local, 'wb') if local else None
+        try:
+            # Feed the pipe to the parser as it arrives instead of holding the whole dump.
+            for chunk in iter(lambda: process.stdout.read(_UI_CHUNK_SIZE), b''):
+                # uiautomator reports where it dumped the layout after the document,
+                # so hold back whatever follows the last tag until more arrives.
+                data = rest + chunk
+                cut = data.rfind(b'>') + 1
+                data, rest = data[:cut], data[cut:]
+                if not data:
+                    continue
+                if f:
+                    f.write(data)
+                parser.feed(data)
+                for event, node in parser.read_events():
+                    if event == 'start':
+                        attrib = node.attrib
+                        if strict and not _is_addressable(attrib):
+                            continue
+                        attrs = dict(attrib)
+                        nodes.append(attrs)
+                        for by, index in indexes:
+                            index[attrs.get(by, '')].append(attrs)
+                    else:
+                        # Only the attributes are kept, free the elements as we go.
+                        node.clear()
+                        while node.getprevious() is not None:
+                            del node.getparent()[0]
+        finally:
+            if f:
+                f.close()
+            _, error = process.communicate()
+        # Only the trailer, or the error message of uiautomator, is left in `rest`.
+        self._debug(' '.join(process.args), rest, error)
+        try:
+            root = parser.close()
+        except etree.XMLSyntaxError:
+            root = None
+        if process.returncode or root is None:
+            message = (error or rest).decode('utf-8', 'replace').strip()
+            raise AndroidDriverException(f'Cannot dump the interface layout: {message!r}.')
+        self._nodes = tuple(nodes)
+        self._index = dict(indexes)
+
+    def _index_attr(self, by) -> dict:
+        '''Map each value of the attribute `by`, one not indexed by uidump, to the nodes carrying it.'''
+        index = self._index[by] = defaultdict(list)
+        for node in self._nodes:
+            index[node.get(by, '')].append(node)
+        return index
+
+    def _invalidate_ui(self) -> None:
+        '''Forget the last interface layout, the next find will dump it again.'''
+        self._nodes = None
+        self._index = None
+
+    def _find_nodes(self, value, by, update) -> list:
+        '''Return the nodes whose attribute `by` equals `value`.'''
+        if update or self._nodes is None:
+            self.uidump()
+        index = self._index.get(by)
+        if index is None:
+            index = self._index_attr(by)
+        return index.get(value, [])
+
+    def _build_elem(self, node, by, value) -> Elements:
+        '''Create the element for a node.'''
+        x1, y1, x2, y2 = map(int, node['bounds'].translate(_BOUNDS_TRANS).split())
+        click_point = (x1 + x2) >> 1, (y1 + y2) >> 1
+        return self._element_cls(self, node, by, value, [x1, y1, x2, y2], click_point)
 
     def find_element(self, value, by=By.ID, update=False) -> Elements:
         '''Find a element or the first element.'''
-        if update or not self._nodes:
-            self.uidump()
-        for node in self._nodes:
-            if node.attrib[by] == value:
-                bounds = node.attrib['bounds']
-                coord = list(map(int, re.findall(r'\d+', bounds)))
-                click_point = (coord[0] + coord[2]) / \
-                    2, (coord[1] + coord[3]) / 2
-                return self._element_cls(self, node.attrib, by, value, coord, click_point)
-        raise NoSuchElementException(f'No such element: {by}={value!r}.')
+        nodes = self._find_nodes(value, by, update)
+        if not nodes:
+            raise NoSuchElementException(f'No such element: {by}={value!r}.')
+        return self._build_elem(nodes[0], by, value)
 
     def find_elements(self, value, by=By.ID, update=False) -> Elements:
         '''Find all elements.'''
-        elements = []
-        if update or not self._nodes:
-            self.uidump()
-        for node in nodes:
-            if node.attrib[by] == value:
-                bounds = node.attrib['bounds']
-                coord = list(map(int, re.findall(r'\d+', bounds)))
-                click_point = (coord[0] + coord[2]) / \
-                    2, (coord[1] + coord[3]) / 2
-                elements.append(self._element_cls(
-                    self, node.attrib, by, value, coord, click_point))
-        if elements:
-            return elements
-        raise NoSuchElementException(f'No such element: {by}={value!r}.')
+        nodes = self._find_nodes(value, by, update)
+        if not nodes:
+            raise NoSuchElementException(f'No such element: {by}={value!r}.')
+        return [self._build_elem(node, by, value) for node in nodes]
 
     def find_element_by_id(self, id_, update=False) -> Elements:
         '''Finds an element by id.
@@ -0,0 +1,67 @@
+# Licensed to the White Turing under one or more
+# contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The SFC licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+
+class Batch(object):
+    '''Collects actions and runs them in a single shell command line.'''
+
+    def __init__(self, parent, stop_on_error: bool = False) -> None:
+        self._parent = parent
+        self._stop_on_error = stop_on_error
+        self._cmds = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+
+    def click(self, x: int, y: int) -> None:
+        '''Simulate finger click.'''
+        self._cmds.append(self._parent._click_cmd(x, y))
+
+    def swipe(self, x1: int, y1: int, x2: int, y2: int, duration: int = 100) -> None:
+        '''Simulate finger swipe. (1000ms = 1s)'''
+        self._cmds.append(self._parent._swipe_cmd(x1, y1, x2, y2, duration))
+
+    def long_press(self, x: int, y: int, duration: int = 1000) -> None:
+        '''Simulate finger long press somewhere. (1000ms = 1s)'''
+        self._cmds.append(self._parent._swipe_cmd(x, y, x, y, duration))
+
+    def send_keys(self, text: str = 'cerium') -> None:
+        '''Simulates typing keys.'''
+        self._cmds.append(self._parent._send_keys_cmd(text))
+
+    def send_keyevents(self, keyevent: int) -> None:
+        '''Simulates typing keyevents.'''
+        self._cmds.append(self._parent._keyevent_cmd(keyevent))
+
+    def send_keyevents_long_press(self, keyevent: int) -> None:
+        '''Simulates typing keyevents long press.'''
+        self._cmds.append(self._parent._keyevent_cmd(keyevent, long_press=True))
+
+    def sleep(self, seconds: float) -> None:
+        '''Wait on the device before the next action.'''
+        self._cmds.append(f'sleep {seconds}')
+
+    def execute(self) -> str:
+        '''Run the collected actions and return the output.'''
+        cmds, self._cmds = self._cmds, []
+        if not cmds:
+            return ''
+        return self._parent.execute_script(cmds, self._stop_on_error)
@@ -23,6 +23,7 @@ class By(object):
 
     ID = "resource-id"
     TEXT = "text"
+    NAME = TEXT
     CLASS = "class"
     CONTENT_DESC = "content-desc"
     PACKAGE_NAME = 'package'
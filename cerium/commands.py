@@ -15,11 +15,18 @@
 # specific language governing permissions and limitations
 # under the License.
 
+import io
 import os
+import queue
+import shlex
 import subprocess
+import threading
+from collections import OrderedDict
 from subprocess import PIPE
 from typing import Any, Union
 
+from .exceptions import DeviceConnectionException
+
 _PATH = str
 
 
@@ -59,6 +66,202 @@ class Commands(object):
     def execute(self, *, args: Union[list, tuple], options: dict) -> tuple:
         '''Execute command.'''
         cmd = self._build_cmd(args)
-        process = subprocess.Popen(cmd, stdout=PIPE, stderr=PIPE, stdin=PIPE,
-                                   encoding='utf-8', shell=options.get('shell', False), env=options.get('env'))
+        process = subprocess.Popen(cmd, stdout=options.get('stdout', PIPE), stderr=PIPE, stdin=PIPE,
+                                   encoding=options.get('encoding', 'utf-8'), shell=options.get('shell', False), env=options.get('env'))
         return process
+
+
+class _ShellSession(object):
+    '''A long-lived `adb shell` process that commands are piped into.
+
+    Spawning adb and opening a new transport for every command dominates the
+    cost of most device interactions, so commands are written to the stdin of
+    a single shell and their output is read back up to a sentinel line.
+    '''
+
+    _EOF = '__CERIUM_EOF__'
+    _ERR = '__CERIUM_ERR__'
+    # Written with an empty quote in the middle, so that a shell echoing its
+    # input back cannot produce the sentinel, only the echo command can.
+    _ECHO_EOF = 'echo __CERIUM_""EOF__'
+    _ECHO_ERR = 'echo __CERIUM_""ERR__ >&2'
+
+    def __init__(self, cmd: Union[list, tuple], env: dict = None) -> None:
+        self._cmd = list(cmd)
+        self._env = env
+        self._process = None
+        self._split_stderr = False
+        self._lock = threading.RLock()
+
+    def _spawn(self) -> None:
+        '''Start the shell process.
+
+        Devices without the shell protocol run the shell on a terminal, which
+        echoes the input, prints a prompt and merges stderr into stdout. Turn
+        off the echo and the prompt, then probe which stream the error
+        sentinel arrives on before the first command.
+        '''
+        self._process = subprocess.Popen(self._cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE, env=self._env)
+        # stdin stays binary: a text wrapper would turn '\n' into os.linesep, and
+        # a trailing '\r' breaks the last word of every command on Windows.
+        self._stdout = io.TextIOWrapper(self._process.stdout, encoding='utf-8')
+        # stderr is drained as it comes, so a command writing a lot to it
+        # cannot block while stdout is read up to the sentinel.
+        self._errors = queue.Queue()
+        self._stderr_reader = threading.Thread(
+            target=self._pump, args=(io.TextIOWrapper(self._process.stderr, encoding='utf-8'), self._errors),
+            daemon=True)
+        self._stderr_reader.start()
+        self._write(f"stty -echo 2>/dev/null; PS1=''; PS2=''; {self._ECHO_ERR}; {self._ECHO_EOF}")
+        output, _ = self._read_until(self._stdout.readline, self._EOF)
+        self._split_stderr = self._ERR not in output
+        if self._split_stderr:
+            self._read_until(self._errors.get, self._ERR)
+
+    @staticmethod
+    def _pump(stream, lines: queue.Queue) -> None:
+        '''Move the lines of the stream into the queue, then an empty line at EOF.'''
+        try:
+            for line in iter(stream.readline, ''):
+                lines.put(line)
+        except (OSError, ValueError):
+            pass
+        finally:
+            lines.put('')
+            stream.close()
+
+    def _write(self, line: str) -> None:
+        try:
+            self._process.stdin.write((line + '\n').encode('utf-8'))
+            self._process.stdin.flush()
+        except OSError:
+            self._closed_by_device()
+
+    def _closed_by_device(self) -> None:
+        '''Close the session and raise, with what adb wrote to stderr if anything.'''
+        error = self._pending_errors()
+        self.close()
+        raise DeviceConnectionException(
+            f'The shell session was closed by the device: {error}' if error else
+            'The shell session was closed by the device.')
+
+    def _read_until(self, readline, sentinel: str) -> tuple:
+        '''Read lines up to the sentinel, returning the text before it and the rest of its line.'''
+        lines = []
+        while True:
+            line = readline()
+            if not line:
+                self._closed_by_device()
+            index = line.find(sentinel)
+            if index != -1:
+                lines.append(line[:index])
+                return ''.join(lines), line[index + len(sentinel):].strip()
+            lines.append(line)
+
+    def _pending_errors(self) -> str:
+        '''What adb wrote to stderr before the session ended, e.g. that the device is offline.'''
+        lines = []
+        try:
+            line = self._errors.get(timeout=1)
+            while line:
+                lines.append(line)
+                line = self._errors.get(timeout=1)
+        except queue.Empty:
+            pass
+        return ''.join(lines).strip()
+
+    def execute(self, cmd: str, timeout: float = None) -> tuple:
+        '''Run a command line in the shell and return its output, error and exit status.
+
+        The command runs in its own `sh -c` with stdin from /dev/null, so it can
+        neither swallow the sentinel nor leave a quote open, and a `cd` or
+        `export` does not leak into the commands of other drivers. If it has
+        not finished after `timeout` seconds, the session is killed.
+        '''
+        line = f'sh -c {shlex.quote(cmd)} </dev/null; {self._ECHO_EOF}$?'
+        with self._lock:
+            if self._process is None or self._process.poll() is not None:
+                self.close()
+                self._spawn()
+            if self._split_stderr:
+                line += f'; {self._ECHO_ERR}'
+            timer = None
+            if timeout is not None:
+                timer = threading.Timer(timeout, self._process.kill)
+                timer.start()
+            try:
+                self._write(line)
+                output, status = self._read_until(self._stdout.readline, self._EOF)
+                error = ''
+                if self._split_stderr:
+                    error, _ = self._read_until(self._errors.get, self._ERR)
+            except DeviceConnectionException:
+                if timer is not None and not timer.is_alive():
+                    raise DeviceConnectionException(
+                        f'The shell command timed out after {timeout} seconds: {cmd!r}.') from None
+                raise
+            finally:
+                if timer is not None:
+                    timer.cancel()
+            return output, error, int(status)
+
+    def close(self) -> None:
+        '''Close the shell, and terminate it if it has not exited a second after EOF.
+
+        The stderr reader closes its stream once the process is gone.
+        '''
+        with self._lock:
+            process, self._process = self._process, None
+            if process is None:
+                return
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+            # The shell exits on EOF, only terminate it if it does not.
+            try:
+                process.wait(1)
+            except subprocess.TimeoutExpired:
+                process.terminate()
+                process.wait()
+            self._stdout.close()
+            self._stderr_reader.join(1)
+
+
+class _ShellPool(object):
+    '''Shell sessions shared by all drivers of the process.
+
+    Sessions are keyed by their adb command line, so drivers of the same
+    device reuse one shell. Once more than `max_sessions` are open, the least
+    recently used one is closed.
+    '''
+
+    def __init__(self, max_sessions: int = 16) -> None:
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, cmd: Union[list, tuple], env: dict = None) -> _ShellSession:
+        '''Return the session running `cmd`, starting it if needed.'''
+        key = tuple(cmd)
+        evicted = []
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._sessions[key] = _ShellSession(cmd, env=env)
+            self._sessions.move_to_end(key)
+            while len(self._sessions) > self.max_sessions:
+                evicted.append(self._sessions.popitem(last=False)[1])
+        for old in evicted:
+            old.close()
+        return session
+
+    def discard(self, cmd: Union[list, tuple]) -> None:
+        '''Close the session running `cmd`.'''
+        with self._lock:
+            session = self._sessions.pop(tuple(cmd), None)
+        if session is not None:
+            session.close()
+
+
+_shell_pool = _ShellPool()
@@ -0,0 +1,143 @@
+# Licensed to the White Turing under one or more
+# contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The SFC licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import socket
+import threading
+import time
+
+from .exceptions import AndroidDriverException, DeviceConnectionException
+from .utils import free_port
+
+
+class MonkeyInjector(object):
+    '''Injects input events through a persistent `monkey --port` server.
+
+    `input` starts a new Java VM on the device for every event, while the
+    monkey server is started once and then reads each event as a line from
+    a forwarded socket.
+    '''
+
+    def __init__(self, parent, device_port: int = 1080, timeout: float = 10) -> None:
+        self._parent = parent
+        self._device_port = device_port
+        self._timeout = timeout
+        self._host_port = None
+        self._process = None
+        self._socket = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        '''Start the monkey server on the device and connect to it.'''
+        parent = self._parent
+        self._host_port = free_port()
+        parent._execute('-s', parent.device_sn, 'forward',
+                        f'tcp:{self._host_port}', f'tcp:{self._device_port}')
+        self._process = parent.execute(
+            args=('-s', parent.device_sn, 'shell', 'monkey', '--port', str(self._device_port)),
+            options=parent.options)
+        deadline = time.monotonic() + self._timeout
+        while True:
+            try:
+                self._connect()
+                return
+            except (OSError, DeviceConnectionException):
+                self._disconnect()
+                if time.monotonic() > deadline:
+                    self.close()
+                    raise DeviceConnectionException(
+                        f'Cannot connect to the monkey server on port {self._device_port}.')
+                time.sleep(0.2)
+
+    def _connect(self) -> None:
+        # adb accepts the forwarded connection before the server listens,
+        # so only a reply proves that the server is ready.
+        self._socket = socket.create_connection(('127.0.0.1', self._host_port), 1)
+        self._socket.settimeout(None)
+        self._file = self._socket.makefile('rw', encoding='utf-8', newline='\n')
+        self._send('wake')
+
+    def _disconnect(self) -> None:
+        file, self._file = self._file, None
+        sock, self._socket = self._socket, None
+        if file is not None:
+            try:
+                file.close()
+            except OSError:
+                pass
+        if sock is not None:
+            sock.close()
+
+    def _send(self, line: str) -> None:
+        self._file.write(line + '\n')
+        self._file.flush()
+        response = self._file.readline()
+        if not response:
+            raise DeviceConnectionException(
+                'The monkey server closed the connection.')
+        if not response.startswith('OK'):
+            raise AndroidDriverException(
+                f'Monkey command {line!r} failed: {response.strip()}.')
+
+    def send(self, *lines: str) -> None:
+        '''Send monkey commands in order.'''
+        with self._lock:
+            for line in lines:
+                self._send(line)
+
+    def tap(self, x: int, y: int) -> None:
+        '''Simulate finger click.'''
+        self.send(f'tap {int(x)} {int(y)}')
+
+    def swipe(self, x1: int, y1: int, x2: int, y2: int, duration: int = 100, steps: int = 10) -> None:
+        '''Simulate finger swipe. (1000ms = 1s)'''
+        x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
+        lines = [f'touch down {x1} {y1}']
+        for i in range(1, steps + 1):
+            lines.append(f'sleep {int(duration) // steps}')
+            lines.append(
+                f'touch move {x1 + (x2 - x1) * i // steps} {y1 + (y2 - y1) * i // steps}')
+        lines.append(f'touch up {x2} {y2}')
+        self.send(*lines)
+
+    def long_press(self, x: int, y: int, duration: int = 1000) -> None:
+        '''Simulate finger long press somewhere. (1000ms = 1s)'''
+        x, y = int(x), int(y)
+        self.send(f'touch down {x} {y}', f'sleep {int(duration)}', f'touch up {x} {y}')
+
+    def press(self, keyevent: int) -> None:
+        '''Simulates typing keyevents.'''
+        self.send(f'press {keyevent}')
+
+    def close(self) -> None:
+        '''Stop the monkey server and remove the port forwarding.'''
+        if self._file is not None:
+            try:
+                self._file.write('quit\n')
+                self._file.flush()
+            except OSError:
+                pass
+        self._disconnect()
+        process, self._process = self._process, None
+        if process is not None and process.poll() is None:
+            process.terminate()
+            process.wait()
+        host_port, self._host_port = self._host_port, None
+        if host_port is not None:
+            parent = self._parent
+            parent._execute('-s', parent.device_sn, 'forward',
+                            '--remove', f'tcp:{host_port}')
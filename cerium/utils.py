@@ -17,8 +17,9 @@
 
 """The utils methods."""
 
+import functools
 import socket
-from typing import Dict, Union
+from typing import Callable, Dict, Union
 
 
 def free_port() -> int:
@@ -55,4 +56,21 @@ def is_connectable(host: str, port: Union[int, str]) -> bool:
 
 def merge_dict(dict1: Union[Dict], dict2: Union[Dict]) -> Dict:
     new_dict = {**dict1, **dict2}
-    return new_dict
\ No newline at end of file
+    return new_dict
+
+
+def memoize_device_prop(func: Callable) -> Callable:
+    """Caches the result of a device property getter.
+
+    The value is stored in the driver's `_prop_cache`, keyed by the device
+    serial number, until `invalidate_device_props` is called.
+    """
+    @functools.wraps(func)
+    def wrapper(self):
+        key = (self.device_sn, func.__name__)
+        try:
+            return self._prop_cache[key]
+        except KeyError:
+            value = self._prop_cache[key] = func(self)
+            return value
+    return wrapper
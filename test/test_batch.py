@@ -0,0 +1,88 @@
+import shlex
+import unittest
+
+from cerium.androiddriver import BaseAndroidDriver
+from cerium.exceptions import AndroidDriverException, CharactersException
+
+
+def make_driver(returncode=0, error=''):
+    driver = BaseAndroidDriver.__new__(BaseAndroidDriver)
+    driver.device_sn = 'emulator-5554'
+    driver.commands = []
+    driver._shell_exec_rc = lambda *args, timeout=None: (
+        driver.commands.append(' '.join(args)) or ('', error, returncode))
+    return driver
+
+
+class TestBatch(unittest.TestCase):
+
+    def test_actions_in_one_command_line(self):
+        driver = make_driver()
+        with driver.batch() as b:
+            b.click(500, 250)
+            b.sleep(0.5)
+            b.swipe(1, 2, 3, 4)
+            b.long_press(5, 6)
+            b.send_keys("it's")
+            b.send_keyevents(66)
+            b.send_keyevents_long_press(26)
+        self.assertEqual(driver.commands, [
+            'input tap 500 250 ; sleep 0.5 ; input swipe 1 2 3 4 100 ; input swipe 5 6 5 6 1000 ; '
+            'input text \'it\'"\'"\'s\' ; input keyevent 66 ; input keyevent --longpress 26'])
+
+    def test_stop_on_error_joins_with_and(self):
+        driver = make_driver()
+        with driver.batch(stop_on_error=True) as b:
+            b.click(1, 2)
+            b.send_keyevents(4)
+        self.assertEqual(driver.commands, ['input tap 1 2 && input keyevent 4'])
+
+    def test_empty_batch(self):
+        driver = make_driver()
+        with driver.batch():
+            pass
+        self.assertEqual(driver.commands, [])
+
+    def test_not_run_on_exception(self):
+        driver = make_driver()
+        with self.assertRaises(KeyError):
+            with driver.batch() as b:
+                b.click(1, 2)
+                raise KeyError
+        self.assertEqual(driver.commands, [])
+
+
+class TestExecuteScript(unittest.TestCase):
+
+    def test_failure_ignored_without_stop_on_error(self):
+        driver = make_driver(returncode=1, error='failed')
+        driver.execute_script(['false', 'true'])
+        self.assertEqual(driver.commands, ['false ; true'])
+
+    def test_stop_on_error_raises(self):
+        driver = make_driver(returncode=2, error='sh: bad: not found\n')
+        with self.assertRaisesRegex(AndroidDriverException, 'exit status 2.*not found'):
+            driver.execute_script(['bad', 'true'], stop_on_error=True)
+
+    def test_batch_stop_on_error_raises(self):
+        driver = make_driver(returncode=1)
+        with self.assertRaises(AndroidDriverException):
+            with driver.batch(stop_on_error=True) as b:
+                b.click(1, 2)
+
+
+class TestSendKeysCommand(unittest.TestCase):
+
+    def test_quoting(self):
+        driver = make_driver()
+        for text in ('cerium', "I'm White Turing.", 'a b;c&&d', '$HOME `id` "q"', ''):
+            self.assertEqual(shlex.split(driver._send_keys_cmd(text)), ['input', 'text', text])
+
+    def test_cjk_rejected(self):
+        driver = make_driver()
+        with self.assertRaisesRegex(CharactersException, "'中'"):
+            driver._send_keys_cmd('abc中文')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+
+from cerium.androiddriver import _PROP_RE, BaseAndroidDriver
+
+GETPROP = '''[dalvik.vm.heapsize]: [512m]
+[ro.build.version.release]: [9]
+[ro.build.version.sdk]: [28]
+[ro.product.model]: [Pixel 3]
+[persist.sys.empty]: []
+'''
+
+
+def make_driver(outputs):
+    driver = BaseAndroidDriver.__new__(BaseAndroidDriver)
+    driver.device_sn = 'emulator-5554'
+    driver._prop_cache = {}
+    driver.calls = []
+
+    def shell_exec(*args, timeout=None):
+        driver.calls.append(args)
+        return outputs[args[0]], ''
+    driver._shell_exec = shell_exec
+    return driver
+
+
+class TestProps(unittest.TestCase):
+
+    def test_prop_re(self):
+        self.assertEqual(dict(_PROP_RE.findall(GETPROP)), {
+            'dalvik.vm.heapsize': '512m',
+            'ro.build.version.release': '9',
+            'ro.build.version.sdk': '28',
+            'ro.product.model': 'Pixel 3',
+            'persist.sys.empty': '',
+        })
+
+    def test_props_from_one_getprop(self):
+        driver = make_driver({'getprop': GETPROP})
+        self.assertEqual(driver.get_device_model(), 'Pixel 3')
+        self.assertEqual(driver.get_android_version(), '9')
+        self.assertEqual(driver.get_sdk_version(), '28')
+        self.assertEqual(driver.calls, [('getprop',)])
+
+
+class TestMemoizeDeviceProp(unittest.TestCase):
+
+    def test_cached_until_invalidated(self):
+        driver = make_driver({'wm': 'Physical size: 1080x1920\n'})
+        self.assertEqual(driver.get_resolution(), (1080, 1920))
+        self.assertEqual(driver.get_resolution(), (1080, 1920))
+        self.assertEqual(len(driver.calls), 1)
+        driver.invalidate_device_props()
+        driver.get_resolution()
+        self.assertEqual(len(driver.calls), 2)
+
+    def test_keyed_by_device(self):
+        driver = make_driver({'wm': 'Physical density: 420\n'})
+        self.assertEqual(driver.get_screen_density(), 420)
+        driver.device_sn = 'emulator-5556'
+        driver.get_screen_density()
+        self.assertEqual(len(driver.calls), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import io
+import shutil
+import sys
+import unittest
+
+from cerium.commands import _ShellPool, _ShellSession
+from cerium.exceptions import DeviceConnectionException
+
+
+@unittest.skipUnless(shutil.which('sh'), 'requires a local sh')
+class TestShellSession(unittest.TestCase):
+
+    def setUp(self):
+        self.session = _ShellSession(['sh'])
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_output_error_and_status(self):
+        output, error, status = self.session.execute('echo out; echo err >&2; exit 3')
+        self.assertEqual(output, 'out\n')
+        self.assertEqual(error, 'err\n')
+        self.assertEqual(status, 3)
+
+    def test_output_without_trailing_newline(self):
+        self.assertEqual(self.session.execute('printf abc'), ('abc', '', 0))
+
+    def test_command_reading_stdin(self):
+        self.assertEqual(self.session.execute('head -c 5'), ('', '', 0))
+        self.assertEqual(self.session.execute('echo next'), ('next\n', '', 0))
+
+    def test_unbalanced_quote(self):
+        output, error, status = self.session.execute("echo 'x")
+        self.assertEqual(output, '')
+        self.assertTrue(error)
+        self.assertNotEqual(status, 0)
+        self.assertEqual(self.session.execute('echo next'), ('next\n', '', 0))
+
+    def test_state_does_not_leak(self):
+        self.session.execute('cd /; export CERIUM_TEST=1')
+        output, _, _ = self.session.execute('pwd; echo ${CERIUM_TEST:-unset}')
+        self.assertNotEqual(output.splitlines()[0], '/')
+        self.assertEqual(output.splitlines()[1], 'unset')
+
+    def test_commands_end_with_bare_newline(self):
+        self.session.execute('true')
+        process = self.session._process
+        stdin, process.stdin = process.stdin, io.BytesIO()
+        try:
+            self.session._write('getprop')
+            self.assertEqual(process.stdin.getvalue(), b'getprop\n')
+        finally:
+            process.stdin = stdin
+
+    def test_timeout(self):
+        with self.assertRaises(DeviceConnectionException):
+            self.session.execute('exec sleep 5 >/dev/null 2>&1', timeout=0.2)
+        self.assertEqual(self.session.execute('echo back'), ('back\n', '', 0))
+
+    def test_respawn_after_close(self):
+        self.session.execute('true')
+        self.session.close()
+        self.assertEqual(self.session.execute('echo again'), ('again\n', '', 0))
+
+    def test_large_error_output(self):
+        output, error, status = self.session.execute(
+            'head -c 200000 /dev/zero | tr "\\0" x >&2; echo done', timeout=10)
+        self.assertEqual(output, 'done\n')
+        self.assertEqual(len(error), 200000)
+        self.assertEqual(status, 0)
+
+    def test_device_error_at_spawn(self):
+        session = _ShellSession(['sh', '-c', "echo \"error: device 'x' not found\" >&2; exit 1"])
+        with self.assertRaisesRegex(DeviceConnectionException, "device 'x' not found"):
+            session.execute('true')
+
+
+@unittest.skipUnless(sys.platform.startswith('linux') and shutil.which('script') and shutil.which('sh'),
+                     'requires util-linux script and a local sh')
+class TestTerminalShellSession(unittest.TestCase):
+    '''Devices without the shell protocol run `adb shell` on a terminal.'''
+
+    def setUp(self):
+        self.session = _ShellSession(['script', '-qfc', 'sh', '/dev/null'])
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_echo_and_prompt(self):
+        self.assertEqual(self.session.execute('echo hi'), ('hi\n', '', 0))
+        self.assertEqual(self.session.execute('echo bye; exit 4'), ('bye\n', '', 4))
+
+    def test_error_is_merged(self):
+        output, error, status = self.session.execute('echo err >&2; exit 1')
+        self.assertEqual(output, 'err\n')
+        self.assertEqual(error, '')
+        self.assertEqual(status, 1)
+
+
+class TestShellPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = _ShellPool(max_sessions=2)
+        self.closed = []
+
+    def _get(self, *cmd):
+        session = self.pool.get(cmd)
+        session.close = lambda: self.closed.append(cmd)
+        return session
+
+    def test_same_command_same_session(self):
+        self.assertIs(self._get('a'), self.pool.get(('a',)))
+
+    def test_least_recently_used_is_closed(self):
+        self._get('a')
+        self._get('b')
+        self.pool.get(('a',))
+        self._get('c')
+        self.assertEqual(self.closed, [('b',)])
+
+    def test_discard(self):
+        self._get('a')
+        self.pool.discard(('a',))
+        self.pool.discard(('missing',))
+        self.assertEqual(self.closed, [('a',)])
+
+
+if __name__ == '__main__':
+    unittest.main()
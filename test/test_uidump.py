@@ -0,0 +1,99 @@
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from cerium import androiddriver
+from cerium.androiddriver import BaseAndroidDriver
+from cerium.exceptions import AndroidDriverException
+
+LAYOUT = (
+    b'<?xml version=\'1.0\' encoding=\'UTF-8\' standalone=\'yes\' ?>'
+    b'<hierarchy rotation="0">'
+    b'<node index="0" text="" resource-id="" class="android.widget.FrameLayout" package="p" '
+    b'content-desc="" clickable="false" long-clickable="false" scrollable="false" '
+    b'checkable="false" focusable="false" bounds="[0,0][1080,1920]">'
+    b'<node index="0" text="" resource-id="" class="android.widget.ScrollView" package="p" '
+    b'content-desc="" clickable="false" long-clickable="false" scrollable="true" '
+    b'checkable="false" focusable="false" bounds="[0,0][1080,1800]">'
+    b'<node index="0" text="OK" resource-id="p:id/ok" class="android.widget.Button" package="p" '
+    b'content-desc="" clickable="true" long-clickable="false" scrollable="false" '
+    b'checkable="false" focusable="true" bounds="[100,200][300,400]"/>'
+    b'</node></node></hierarchy>'
+)
+TRAILER = b'UI hierchary dumped to: /dev/tty\n'
+
+
+class FakeProcess(object):
+    '''Stands in for the `adb exec-out uiautomator dump` process.'''
+
+    args = ['adb', 'exec-out', 'uiautomator', 'dump']
+
+    def __init__(self, stdout, error=b'', returncode=0):
+        self.stdout = io.BytesIO(stdout)
+        self.error = error
+        self.returncode = returncode
+
+    def communicate(self):
+        return b'', self.error
+
+
+def make_driver(stdout, error=b'', returncode=0, strict_ui=True):
+    driver = BaseAndroidDriver.__new__(BaseAndroidDriver)
+    driver.device_sn = 'emulator-5554'
+    driver.options = {}
+    driver._dev = False
+    driver._strict_ui = strict_ui
+    driver.execute = lambda args, options: FakeProcess(stdout, error, returncode)
+    return driver
+
+
+class TestUIDump(unittest.TestCase):
+
+    def test_nodes(self):
+        driver = make_driver(LAYOUT + TRAILER)
+        driver.uidump()
+        self.assertEqual([node['class'] for node in driver._nodes],
+                         ['android.widget.ScrollView', 'android.widget.Button'])
+
+    def test_small_chunks(self):
+        for size in (1, 7, 64):
+            with mock.patch.object(androiddriver, '_UI_CHUNK_SIZE', size):
+                driver = make_driver(LAYOUT + TRAILER, strict_ui=False)
+                driver.uidump()
+                self.assertEqual(len(driver._nodes), 3)
+
+    def test_local_copy_without_trailer(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            local = os.path.join(tmp, 'uidump.xml')
+            with mock.patch.object(androiddriver, '_UI_CHUNK_SIZE', 16):
+                make_driver(LAYOUT + TRAILER).uidump(local)
+            with open(local, 'rb') as f:
+                self.assertEqual(f.read(), LAYOUT)
+
+    def test_strict_ui_disabled(self):
+        driver = make_driver(LAYOUT + TRAILER, strict_ui=False)
+        driver.uidump()
+        self.assertEqual(driver._nodes[0]['class'], 'android.widget.FrameLayout')
+
+    def test_uiautomator_error(self):
+        driver = make_driver(b'ERROR: could not get idle state.\n')
+        with self.assertRaisesRegex(AndroidDriverException, 'could not get idle state'):
+            driver.uidump()
+
+    def test_exit_status(self):
+        driver = make_driver(b'', error=b'error: device offline\n', returncode=1)
+        with self.assertRaisesRegex(AndroidDriverException, 'device offline'):
+            driver.uidump()
+
+    def test_find_element(self):
+        driver = make_driver(LAYOUT + TRAILER)
+        element = driver.find_element_by_id('p:id/ok')
+        self.assertEqual(element.coord, [100, 200, 300, 400])
+        self.assertEqual(driver.find_element_by_name('OK', True).coord, [100, 200, 300, 400])
+        self.assertEqual(len(driver.find_elements('p', by='package')), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()